@@ -4,11 +4,13 @@
 ==================
 Download RAW files da PRIDE FTP per il dataset WWA_30m.
 
-Parallelizzato con ThreadPoolExecutor (16 connessioni FTP simultanee).
+Parallelizzato con asyncio + aioftp (16 connessioni FTP simultanee);
+con --legacy-threads (o senza aioftp) usa ThreadPoolExecutor + ftplib.
 Non serve usare tutti i 64 core perché il download è I/O bound.
 
 Usage:
-    python 01_download_raw.py [--dry-run] [--max-files N]
+    python 01_download_raw.py [--dry-run] [--max-files N] [--refresh-listing]
+                              [--legacy-threads]
 
 HPC sbatch:
     #SBATCH --time=06:00:00
@@ -16,15 +18,25 @@ HPC sbatch:
 """
 
 import ftplib
+import json
 import os
+import socket
 import sys
 import argparse
 import re
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
+import threading
+import atexit
+import functools
 import time
-import pandas as pd
+import asyncio
+
+try:
+    import aioftp
+except ImportError:  # fallback: download con thread + ftplib
+    aioftp = None
 
 # ============================================================
 # CONFIGURAZIONE HPC - AUTO-DETECT PATHS
@@ -57,12 +69,35 @@ PSM_SEARCH_PATHS = [
     PROJECT_DIR / "raw_data" / "fragpipe",
 ]
 
+@functools.lru_cache(maxsize=None)
+def list_psm_tsv(root):
+    """
+    Trova tutti i psm.tsv sotto root con una sola scansione (memoizzata).
+    
+    Le directory 'lib' vengono saltate senza scendere al loro interno.
+    """
+    found = []
+    stack = [os.fspath(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != 'lib':
+                        stack.append(entry.path)
+                elif entry.name == 'psm.tsv':
+                    found.append(Path(entry.path))
+    return tuple(sorted(found))
+
+
 def find_psm_dir():
     """Trova la directory con i PSM files."""
     for path in PSM_SEARCH_PATHS:
         if path.exists():
-            psm_files = list(path.rglob("psm.tsv"))
-            if psm_files:
+            if list_psm_tsv(path):
                 print(f"Found PSM dir: {path}")
                 return path
     return None
@@ -72,69 +107,307 @@ PSM_DIR = find_psm_dir()
 FTP_HOST = "ftp.pride.ebi.ac.uk"
 FTP_PATH = "/pride/data/archive/2023/07/PXD037527/"
 
+# Cache del listing NLST di PRIDE (valida 24 h)
+NLST_CACHE = RAW_DIR / ".pride_nlst.json"
+NLST_CACHE_TTL = 24 * 3600
+
+# Cache psm.tsv -> mzML name (invalidata dal mtime del psm.tsv)
+PSM_NAME_CACHE = RAW_DIR / ".psm_mzml_names.json"
+
 # 16 download paralleli (limite pratico per FTP)
-N_DOWNLOADS = 1
+N_DOWNLOADS = 16
+
+# Buffer di scrittura / ricezione per i RAW (centinaia di MB ciascuno)
+WRITE_BUFFER = 4 * 1024 * 1024
+RECV_BUFFER = 4 * 1024 * 1024
+BLOCKSIZE = 1024 * 1024
 
 print_lock = Lock()
 
+# Una sessione FTP per thread, riusata tra i download
+_local = threading.local()
+_sessions = []
+_sessions_lock = Lock()
+
 
 def safe_print(msg):
     with print_lock:
         print(msg, flush=True)
 
 
+def read_mzml_name(pf):
+    """Nome mzML dalla prima riga di un psm.tsv (senza pandas)."""
+    with open(pf) as fh:
+        header = fh.readline().rstrip('\n').split('\t')
+        idx = header.index('Spectrum')
+        first = fh.readline().rstrip('\n').split('\t')
+    return first[idx].rsplit('.', 3)[0]
+
+
 def get_required_raw_files():
     """Trova i RAW file necessari leggendo i PSM."""
     print("Scanning PSM files...")
     
+    try:
+        cache = json.loads(PSM_NAME_CACHE.read_text())
+    except (FileNotFoundError, ValueError):
+        cache = {}
+    
     raw_files = set()
-    psm_files = [f for f in PSM_DIR.rglob("psm.tsv") if 'lib' not in f.parts]
+    psm_files = list_psm_tsv(PSM_DIR)
+    new_cache = {}
     
     for pf in psm_files:
+        key = str(pf)
         try:
-            df = pd.read_csv(pf, sep='\t', usecols=['Spectrum'], nrows=5)
-            mzml_name = df['Spectrum'].iloc[0].rsplit('.', 3)[0]
+            mtime = os.stat(pf).st_mtime_ns
+            cached = cache.get(key)
+            if cached and cached[0] == mtime:
+                mzml_name = cached[1]
+            else:
+                mzml_name = read_mzml_name(pf)
+            new_cache[key] = [mtime, mzml_name]
             raw_files.add(mzml_name + ".raw")
         except:
             pass
     
+    if new_cache != cache:
+        try:
+            PSM_NAME_CACHE.write_text(json.dumps(new_cache))
+        except OSError:
+            pass
+    
     print(f"Found {len(raw_files)} unique RAW files needed")
     return sorted(raw_files)
 
 
+def list_available_raw(refresh=False):
+    """Lista dei .raw su PRIDE, usando la cache NLST se ancora valida."""
+    if not refresh:
+        try:
+            if time.time() - NLST_CACHE.stat().st_mtime < NLST_CACHE_TTL:
+                available = set(json.loads(NLST_CACHE.read_text()))
+                print(f"\nUsing cached listing: {NLST_CACHE}")
+                return available
+        except (FileNotFoundError, ValueError):
+            pass
+    
+    print(f"\nConnecting to {FTP_HOST}...")
+    ftp = ftplib.FTP(FTP_HOST, timeout=60)
+    ftp.login()
+    ftp.cwd(FTP_PATH)
+    available = []
+    ftp.retrlines('NLST', available.append)
+    available = set(f for f in available if f.endswith('.raw'))
+    ftp.quit()
+    
+    NLST_CACHE.write_text(json.dumps(sorted(available)))
+    return available
+
+
+def tune_socket(sock):
+    """Disabilita Nagle e allarga il buffer di ricezione del kernel."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+    except OSError:
+        pass
+
+
+class TunedFTP(ftplib.FTP):
+    """FTP client che applica tune_socket anche alle connessioni dati."""
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = super().ntransfercmd(cmd, rest)
+        tune_socket(conn)
+        return conn, size
+
+
+def _sz(path):
+    """Dimensione del file in byte, -1 se non esiste (una sola stat)."""
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return -1
+
+
+def _part_path(local_path):
+    """File temporaneo del download: rinominato in local_path solo a fine RETR."""
+    return local_path.with_name(local_path.name + '.part')
+
+
+def _unlink_quiet(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _new_ftp():
+    """Apre una nuova sessione FTP già in FTP_PATH e in modalità binaria."""
+    ftp = TunedFTP(FTP_HOST, timeout=300)
+    tune_socket(ftp.sock)
+    ftp.login()
+    ftp.cwd(FTP_PATH)
+    ftp.voidcmd('TYPE I')
+    with _sessions_lock:
+        _sessions.append(ftp)
+    return ftp
+
+
+def _drop_ftp(ftp):
+    """Chiude una sessione FTP rotta e la rimuove dalla cache."""
+    with _sessions_lock:
+        if ftp in _sessions:
+            _sessions.remove(ftp)
+    try:
+        ftp.close()
+    except Exception:
+        pass
+
+
+@atexit.register
+def _close_sessions():
+    """Chiude tutte le sessioni FTP ancora aperte."""
+    with _sessions_lock:
+        sessions, _sessions[:] = list(_sessions), []
+    for ftp in sessions:
+        try:
+            ftp.quit()
+        except Exception:
+            pass
+
+
+def _retr_to_file(ftp, filename, f):
+    """
+    RETR senza retrbinary: legge dal socket dati in un buffer riusato
+    (recv_into) e scrive direttamente nel file, senza callback per blocco.
+    """
+    buf = bytearray(BLOCKSIZE)
+    view = memoryview(buf)
+    conn = ftp.transfercmd(f'RETR {filename}')
+    try:
+        while True:
+            n = conn.recv_into(buf)
+            if not n:
+                break
+            f.write(view[:n])
+    finally:
+        conn.close()
+    ftp.voidresp()
+
+
 def download_file(args):
-    """Scarica un singolo file."""
+    """Scarica un singolo file (riusando la sessione FTP del thread)."""
     filename, local_path = args
     
-    if local_path.exists() and local_path.stat().st_size > 1_000_000:
+    if _sz(local_path) > 1_000_000:
         return (filename, "SKIP", 0)
     
+    ftp = None
+    part_path = _part_path(local_path)
     try:
-        ftp = ftplib.FTP(FTP_HOST, timeout=300)
-        ftp.login()
-        ftp.cwd(FTP_PATH)
-        ftp.voidcmd('TYPE I')
+        ftp = getattr(_local, 'ftp', None) or _new_ftp()
+        _local.ftp = ftp
         
         start = time.time()
-        with open(local_path, 'wb') as f:
-            ftp.retrbinary(f'RETR {filename}', f.write, blocksize=1024*1024)
+        with open(part_path, 'wb', buffering=WRITE_BUFFER) as f:
+            _retr_to_file(ftp, filename, f)
+            f.flush()
+            size_bytes = os.fstat(f.fileno()).st_size
+        os.replace(part_path, local_path)
         
-        ftp.quit()
         elapsed = time.time() - start
-        size_mb = local_path.stat().st_size / 1e6
+        size_mb = size_bytes / 1e6
         
         return (filename, "OK", size_mb)
         
     except Exception as e:
-        if local_path.exists():
-            local_path.unlink()
+        # Sessione in stato incerto: il prossimo task si riconnette
+        if ftp is not None:
+            _drop_ftp(ftp)
+        _local.ftp = None
         return (filename, f"FAIL: {e}", 0)
+    
+    finally:
+        # Anche su Ctrl+C: nessun RAW parziale resta come local_path
+        _unlink_quiet(part_path)
+
+
+def download_all_threaded(download_args, on_result):
+    """Scarica con N_DOWNLOADS thread (ftplib, sessione riusata per thread)."""
+    with ThreadPoolExecutor(max_workers=N_DOWNLOADS) as ex:
+        futures = [ex.submit(download_file, a) for a in download_args]
+        for fut in as_completed(futures):
+            on_result(fut.result())
+
+
+async def _download_worker(queue, on_result):
+    """Worker asyncio: una connessione aioftp persistente, file dalla coda."""
+    client = None
+    while True:
+        try:
+            filename, local_path = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        
+        if _sz(local_path) > 1_000_000:
+            on_result((filename, "SKIP", 0))
+            continue
+        
+        part_path = _part_path(local_path)
+        try:
+            if client is None:
+                client = aioftp.Client(socket_timeout=300)
+                await client.connect(FTP_HOST)
+                await client.login()
+                await client.change_directory(FTP_PATH)
+            
+            with open(part_path, 'wb', buffering=WRITE_BUFFER) as f:
+                async with client.download_stream(filename) as stream:
+                    async for block in stream.iter_by_block(BLOCKSIZE):
+                        f.write(block)
+                f.flush()
+                size_bytes = os.fstat(f.fileno()).st_size
+            os.replace(part_path, local_path)
+            
+            on_result((filename, "OK", size_bytes / 1e6))
+        
+        except Exception as e:
+            # Connessione in stato incerto: riconnetti al prossimo file
+            if client is not None:
+                client.close()
+                client = None
+            on_result((filename, f"FAIL: {e}", 0))
+        
+        finally:
+            # Anche su CancelledError (Ctrl+C), che non è un Exception
+            _unlink_quiet(part_path)
+    
+    if client is not None:
+        try:
+            await client.quit()
+        except Exception:
+            client.close()
+
+
+async def download_all_async(download_args, on_result):
+    """Scarica con N_DOWNLOADS connessioni aioftp in un unico event loop."""
+    queue = asyncio.Queue()
+    for a in download_args:
+        queue.put_nowait(a)
+    n_workers = min(N_DOWNLOADS, len(download_args))
+    await asyncio.gather(*(_download_worker(queue, on_result) for _ in range(n_workers)))
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--dry-run', action='store_true')
     parser.add_argument('--max-files', type=int, default=None)
+    parser.add_argument('--refresh-listing', action='store_true',
+                        help='Ignore the cached PRIDE NLST listing')
+    parser.add_argument('--legacy-threads', action='store_true',
+                        help='Use ThreadPoolExecutor + ftplib instead of aioftp')
     parser.add_argument('--psm-dir', type=str, default=None, 
                         help='Path to fragpipe directory with psm.tsv files')
     args = parser.parse_args()
@@ -168,14 +441,7 @@ def main():
     required = get_required_raw_files()
     
     # Check FTP
-    print(f"\nConnecting to {FTP_HOST}...")
-    ftp = ftplib.FTP(FTP_HOST, timeout=60)
-    ftp.login()
-    ftp.cwd(FTP_PATH)
-    available = []
-    ftp.retrlines('NLST', available.append)
-    available = set(f for f in available if f.endswith('.raw'))
-    ftp.quit()
+    available = list_available_raw(refresh=args.refresh_listing)
     
     # Filter
     to_download = [f for f in required if f in available]
@@ -191,27 +457,35 @@ def main():
         return
     
     # Download
-    print(f"\nDownloading {len(to_download)} files with {N_DOWNLOADS} threads...")
+    use_async = aioftp is not None and not args.legacy_threads
+    mode = "aioftp connections" if use_async else "threads"
+    print(f"\nDownloading {len(to_download)} files with {N_DOWNLOADS} {mode}...")
     
     download_args = [(f, RAW_DIR / f) for f in to_download]
     stats = {"OK": 0, "SKIP": 0, "FAIL": 0}
-    total_mb = 0
+    totals = {"mb": 0.0, "done": 0}
+    
+    def on_result(result):
+        fn, status, mb = result
+        totals["done"] += 1
+        i = totals["done"]
+        if "OK" in status:
+            stats["OK"] += 1
+            totals["mb"] += mb
+            safe_print(f"[{i}/{len(to_download)}] ✅ {fn} ({mb:.0f} MB)")
+        elif "SKIP" in status:
+            stats["SKIP"] += 1
+            safe_print(f"[{i}/{len(to_download)}] ⏭️  {fn}")
+        else:
+            stats["FAIL"] += 1
+            safe_print(f"[{i}/{len(to_download)}] ❌ {fn}")
     
     start = time.time()
-    with ThreadPoolExecutor(max_workers=N_DOWNLOADS) as ex:
-        futures = {ex.submit(download_file, a): a[0] for a in download_args}
-        for i, fut in enumerate(as_completed(futures), 1):
-            fn, status, mb = fut.result()
-            if "OK" in status:
-                stats["OK"] += 1
-                total_mb += mb
-                safe_print(f"[{i}/{len(to_download)}] ✅ {fn} ({mb:.0f} MB)")
-            elif "SKIP" in status:
-                stats["SKIP"] += 1
-                safe_print(f"[{i}/{len(to_download)}] ⏭️  {fn}")
-            else:
-                stats["FAIL"] += 1
-                safe_print(f"[{i}/{len(to_download)}] ❌ {fn}")
+    if use_async:
+        asyncio.run(download_all_async(download_args, on_result))
+    else:
+        download_all_threaded(download_args, on_result)
+    total_mb = totals["mb"]
     
     elapsed = time.time() - start
     print(f"\n{'='*70}")
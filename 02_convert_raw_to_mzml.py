@@ -5,19 +5,41 @@ Parallel conversion of Thermo RAW files to mzML using ThermoRawFileParser in Sin
 
 import os
 import subprocess
-import glob
 from pathlib import Path
 from multiprocessing import Pool, cpu_count
 import argparse
 from datetime import datetime
 
+# mzML outputs above this size that end with the indexedmzML closing tag
+# are considered complete
+MIN_MZML_SIZE = 10_000_000
+MZML_END_TAG = b'</indexedmzML>'
+
+
+def is_complete_mzml(path):
+    """True if path is a finished indexed mzML (-f=2), not a truncated one"""
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= MIN_MZML_SIZE:
+                return False
+            f.seek(size - 256)
+            return MZML_END_TAG in f.read()
+    except FileNotFoundError:
+        return False
+
+
 def convert_raw_file(args):
     """Convert a single RAW file to mzML"""
-    raw_file, output_dir, container_path, no_peak_picking = args
+    raw_file_abs, output_dir_abs, container_path, no_peak_picking = args
+    
+    basename = os.path.basename(raw_file_abs)
     
-    raw_file_abs = os.path.abspath(raw_file)
-    output_dir_abs = os.path.abspath(output_dir)
-    basename = os.path.basename(raw_file)
+    # Skip if already converted (resumable re-runs)
+    mzml_out = os.path.join(output_dir_abs, os.path.splitext(basename)[0] + '.mzML')
+    if is_complete_mzml(mzml_out):
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏭ Skipped: {basename}")
+        return True, basename, 'SKIP'
     
     # Build command
     cmd = [
@@ -85,8 +107,13 @@ def main():
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
     
-    # Find all RAW files
-    raw_files = glob.glob(os.path.join(args.input_dir, '*.raw'))
+    # Find all RAW files, largest first (better load balancing across the pool)
+    with os.scandir(os.path.abspath(args.input_dir)) as it:
+        raw_entries = [
+            (e.stat().st_size, e.path) for e in it
+            if e.name.endswith('.raw') and e.is_file()
+        ]
+    raw_files = [path for _, path in sorted(raw_entries, reverse=True)]
     
     if not raw_files:
         print(f"No RAW files found in {args.input_dir}")
@@ -99,8 +126,9 @@ def main():
     print("-" * 80)
     
     # Prepare arguments for parallel processing
+    output_dir_abs = os.path.abspath(args.output_dir)
     task_args = [
-        (raw_file, args.output_dir, args.container, args.no_peak_picking)
+        (raw_file, output_dir_abs, args.container, args.no_peak_picking)
         for raw_file in raw_files
     ]
     
@@ -108,19 +136,21 @@ def main():
     start_time = datetime.now()
     
     with Pool(processes=args.jobs) as pool:
-        results = pool.map(convert_raw_file, task_args)
+        results = list(pool.imap_unordered(convert_raw_file, task_args))
     
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
     
     # Summary
     print("-" * 80)
-    successful = sum(1 for success, _, _ in results if success)
-    failed = len(results) - successful
+    skipped = sum(1 for success, _, msg in results if success and msg == 'SKIP')
+    successful = sum(1 for success, _, _ in results if success) - skipped
+    failed = len(results) - successful - skipped
     
     print(f"\nConversion Summary:")
     print(f"  Total files: {len(raw_files)}")
     print(f"  Successful: {successful}")
+    print(f"  Skipped (already converted): {skipped}")
     print(f"  Failed: {failed}")
     print(f"  Total time: {duration/60:.1f} minutes")
     print(f"  Average time per file: {duration/len(raw_files):.1f} seconds")
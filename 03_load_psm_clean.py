@@ -16,7 +16,7 @@ Extracts:
 Parallelized for HPC with 64 cores.
 
 Usage:
-    python 03_load_psm_clean.py [--cores 64]
+    python 03_load_psm_clean.py [--cores 64] [--csv]
 
 HPC sbatch:
     #SBATCH --cpus-per-task=64
@@ -24,14 +24,18 @@ HPC sbatch:
     #SBATCH --mem=64G
 
 Output:
-    processed_data/psm_clean.csv
-    processed_data/psm_chimeric.csv
-    processed_data/spectrum_to_file.pkl
+    processed_data/psm_clean.parquet
+    processed_data/psm_chimeric.parquet
+    processed_data/spectrum_to_file.parquet
+    (+ psm_clean.csv / psm_chimeric.csv with --csv)
 """
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import os
 import sys
+import functools
 from pathlib import Path
 from multiprocessing import Pool, cpu_count
 import pickle
@@ -57,6 +61,7 @@ class Config:
     psm_dir: Optional[Path]
     mzml_dir: Optional[Path]
     n_cores: int = 64
+    write_csv: bool = False
     
     @classmethod
     def auto_detect(cls):
@@ -90,6 +95,14 @@ class Config:
 # PARSERS
 # ============================================================
 
+# Folder names: 118_60_1_6mz_1 (decimal window) / 86_45_24mz_2 (integer window)
+_FOLDER_DEC = re.compile(r'(\d+)_(\d+)_(\d+)_(\d+)mz_(\d+)')
+_FOLDER_INT = re.compile(r'(\d+)_(\d+)_(\d+)mz_(\d+)')
+
+# Modification brackets in Peptide strings, e.g. M[15.9949]
+_MOD_RE = re.compile(r'\[.*?\]')
+
+
 def parse_folder_name(folder_name: str) -> Tuple[Optional[float], Optional[int]]:
     """
     Extract window_mz and replicate from folder name.
@@ -105,14 +118,14 @@ def parse_folder_name(folder_name: str) -> Tuple[Optional[float], Optional[int]]
         (window_mz, replicate) or (None, None) if parse fails
     """
     # Decimal format: 1_6mz = 1.6
-    match = re.match(r'(\d+)_(\d+)_(\d+)_(\d+)mz_(\d+)', folder_name)
+    match = _FOLDER_DEC.match(folder_name)
     if match:
         window = float(f"{match.group(3)}.{match.group(4)}")
         replicate = int(match.group(5))
         return window, replicate
     
     # Integer format: 24mz
-    match = re.match(r'(\d+)_(\d+)_(\d+)mz_(\d+)', folder_name)
+    match = _FOLDER_INT.match(folder_name)
     if match:
         window = float(match.group(3))
         replicate = int(match.group(4))
@@ -121,36 +134,35 @@ def parse_folder_name(folder_name: str) -> Tuple[Optional[float], Optional[int]]
     return None, None
 
 
-def parse_spectrum_column(spectrum_str: str) -> Tuple[Optional[str], Optional[int], Optional[int]]:
+# Spectrum column format: Ex_AuLC1_..._4mz_2.00988.00988.2
+#                                          ^scan ^scan ^charge
+_SPEC_RE = re.compile(r'^(.+)\.(\d+)\.(\d+)\.(\d+)$')
+
+
+def parse_spectrum_column(spectrum: pd.Series) -> pd.DataFrame:
     """
     Parse Spectrum column to extract mzML name, scan number, and charge.
     
-    Format: Ex_AuLC1_..._4mz_2.00988.00988.2
-                              ^scan ^scan ^charge
-    
     Args:
-        spectrum_str: Spectrum column value
+        spectrum: Spectrum column
         
     Returns:
-        (mzml_name, scan_number, charge) or (None, None, None) if parse fails
+        DataFrame with mzml_name, scan_number, charge (NaN if parse fails)
     """
-    try:
-        parts = spectrum_str.rsplit('.', 3)
-        if len(parts) >= 4:
-            mzml_name = parts[0]
-            scan_number = int(parts[1])
-            charge = int(parts[3])
-            return mzml_name, scan_number, charge
-    except (ValueError, AttributeError):
-        pass
-    
-    return None, None, None
+    parts = spectrum.str.extract(_SPEC_RE)
+    return pd.DataFrame({
+        'mzml_name': parts[0],
+        'scan_number': pd.to_numeric(parts[1], errors='coerce', downcast='integer'),
+        'charge': pd.to_numeric(parts[3], errors='coerce', downcast='integer'),
+    })
 
 
 def create_spectrum_key(mzml_name: str, scan_number: int) -> str:
     """
     Create unique spectrum identifier.
     
+    Scalar reference for the key built (vectorized) in load_single_psm_file.
+    
     Args:
         mzml_name: mzML file name
         scan_number: Scan number
@@ -165,15 +177,51 @@ def create_spectrum_key(mzml_name: str, scan_number: int) -> str:
 # FILE LOADER
 # ============================================================
 
-def load_single_psm_file(psm_file: Path) -> Optional[pd.DataFrame]:
+# FragPipe columns used here and in the downstream notebooks
+PSM_COLUMNS = [
+    'Spectrum', 'Peptide', 'Modified Peptide', 'Assigned Modifications',
+    'Charge', 'Retention', 'Observed M/Z', 'Calibrated Observed M/Z',
+    'Calculated M/Z', 'Observed Mass', 'Calculated Peptide Mass', 'Delta Mass',
+    'Hyperscore', 'Nextscore', 'Expectation', 'Probability', 'Intensity',
+    'Protein', 'Is Unique',
+]
+
+# Text columns read as str in every file: an all-empty column would
+# otherwise come back as float64 NaN and fail to concatenate with files
+# where it holds strings
+PSM_TEXT_COLUMNS = {
+    'Spectrum', 'Peptide', 'Modified Peptide', 'Assigned Modifications',
+    'Protein',
+}
+
+
+def select_psm_columns(psm_file: Path) -> List[str]:
+    """
+    Intersect PSM_COLUMNS with the header of a psm.tsv file.
+    
+    Args:
+        psm_file: Path to psm.tsv file
+        
+    Returns:
+        Wanted columns present in the file (header order)
+    """
+    header = pd.read_csv(psm_file, sep='\t', nrows=0).columns
+    wanted = set(PSM_COLUMNS)
+    return [c for c in header if c in wanted]
+
+
+def load_single_psm_file(psm_file: Path) -> Optional[pa.Table]:
     """
     Load a single PSM file with metadata extraction.
     
+    Returns an Arrow Table so main() can chain the per-file buffers
+    with pa.concat_tables instead of copying them in pd.concat.
+    
     Args:
         psm_file: Path to psm.tsv file
         
     Returns:
-        DataFrame with parsed columns or None if loading fails
+        Arrow Table with parsed columns or None if loading fails
     """
     folder_name = psm_file.parent.name
     
@@ -183,7 +231,14 @@ def load_single_psm_file(psm_file: Path) -> Optional[pd.DataFrame]:
     
     try:
         # Load PSM file
-        df = pd.read_csv(psm_file, sep='\t', low_memory=False)
+        columns = select_psm_columns(psm_file)
+        df = pd.read_csv(
+            psm_file,
+            sep='\t',
+            engine='pyarrow',
+            usecols=columns,
+            dtype={c: str for c in columns if c in PSM_TEXT_COLUMNS}
+        )
         
         if len(df) == 0:
             return None
@@ -195,20 +250,25 @@ def load_single_psm_file(psm_file: Path) -> Optional[pd.DataFrame]:
         df['replicate'] = replicate
         
         # Parse Spectrum column
-        spectrum_parsed = df['Spectrum'].apply(parse_spectrum_column)
-        df['mzml_name'] = [p[0] for p in spectrum_parsed]
-        df['scan_number'] = [p[1] for p in spectrum_parsed]
-        df['charge_from_spectrum'] = [p[2] for p in spectrum_parsed]
+        parsed = parse_spectrum_column(df['Spectrum'])
+        df['mzml_name'] = parsed['mzml_name']
+        df['scan_number'] = parsed['scan_number']
+        df['charge_from_spectrum'] = parsed['charge']
         
-        # Create unique spectrum key (CRITICAL FIX!)
-        df['spectrum_key'] = df.apply(
-            lambda row: create_spectrum_key(row['mzml_name'], row['scan_number'])
-            if pd.notna(row['mzml_name']) and pd.notna(row['scan_number'])
-            else None,
-            axis=1
+        # Create unique spectrum key (CRITICAL FIX!) - vectorized "file::scan"
+        valid = df['mzml_name'].notna() & df['scan_number'].notna()
+        df['spectrum_key'] = np.where(
+            valid,
+            df['mzml_name'].astype(str) + '::'
+            + df['scan_number'].astype('Int64').astype(str),
+            None
         )
         
-        return df
+        # Per-file constants: store as categoricals
+        for col in ('mzml_name', 'source_folder'):
+            df[col] = df[col].astype('category')
+        
+        return pa.Table.from_pandas(df, preserve_index=False)
         
     except Exception as e:
         print(f"Error loading {psm_file}: {e}")
@@ -229,6 +289,9 @@ def add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         DataFrame with added columns
     """
+    # Compact dtypes (window_mz stays float64 so 1.6 etc. compare exactly)
+    df['replicate'] = df['replicate'].astype('Int8')
+    
     # Window category
     df['window_category'] = pd.cut(
         df['window_mz'],
@@ -237,17 +300,20 @@ def add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
     )
     
     # Chimericity (PSMs per spectrum)
-    psm_counts = df.groupby('spectrum_key').size()
-    df['n_psm'] = df['spectrum_key'].map(psm_counts)
-    df['is_chimeric'] = df['n_psm'] >= 2
+    df['n_psm'] = (
+        df.groupby('spectrum_key', sort=False)['spectrum_key']
+        .transform('size')
+        .astype('Int32')
+    )
+    df['is_chimeric'] = df['n_psm'].ge(2).fillna(False).astype(bool)
     
     # Peptide length (if Peptide column exists)
     if 'Peptide' in df.columns:
-        df['peptide_length'] = (
-            df['Peptide']
-            .str.replace(r'\[.*?\]', '', regex=True)
-            .str.len()
-        )
+        peptides = df['Peptide']
+        # Only run the regex when some peptide actually carries [mods]
+        if peptides.str.contains('[', regex=False, na=False).any():
+            peptides = peptides.str.replace(_MOD_RE, '', regex=True)
+        df['peptide_length'] = peptides.str.len().astype('Int16')
     
     return df
 
@@ -270,10 +336,15 @@ def print_validation_stats(df: pd.DataFrame) -> Dict:
     print("VALIDATION")
     print(f"{'='*70}")
     
+    # One groupby pass shared by all per-spectrum statistics
+    gb = df.groupby('spectrum_key', observed=True, sort=False)
+    sizes = gb.size()
+    first_mzml = gb['mzml_name'].first()
+    
     n_psm = len(df)
-    n_spectra = df['spectrum_key'].nunique()
-    n_files = df['mzml_name'].nunique()
-    n_chimeric = df[df['is_chimeric']]['spectrum_key'].nunique()
+    n_spectra = len(sizes)
+    n_files = first_mzml.nunique()
+    n_chimeric = int((sizes >= 2).sum())
     
     print(f"Total PSMs: {n_psm:,}")
     print(f"Unique spectra: {n_spectra:,}")
@@ -291,12 +362,7 @@ def print_validation_stats(df: pd.DataFrame) -> Dict:
     
     # Chimericity distribution
     print(f"\nChimericity distribution:")
-    chimeric_dist = (
-        df.groupby('spectrum_key')['n_psm']
-        .first()
-        .value_counts()
-        .sort_index()
-    )
+    chimeric_dist = sizes.value_counts().sort_index()
     for n_psm_val, count in chimeric_dist.head(6).items():
         pct = 100 * count / n_spectra
         print(f"  {n_psm_val} PSM: {count:,} spectra ({pct:.1f}%)")
@@ -333,6 +399,23 @@ def print_validation_stats(df: pd.DataFrame) -> Dict:
 # SAVE FUNCTIONS
 # ============================================================
 
+def write_parquet(df: pd.DataFrame, path: Path) -> None:
+    """
+    Write a dataframe as ZSTD-compressed Parquet.
+    
+    Args:
+        df: Dataframe to write
+        path: Output .parquet path
+    """
+    df.to_parquet(
+        path,
+        engine='pyarrow',
+        compression='zstd',
+        row_group_size=200_000,
+        index=False
+    )
+
+
 def save_outputs(df: pd.DataFrame, config: Config, summary: Dict) -> None:
     """
     Save all output files.
@@ -349,23 +432,34 @@ def save_outputs(df: pd.DataFrame, config: Config, summary: Dict) -> None:
     config.output_dir.mkdir(parents=True, exist_ok=True)
     
     # Full PSM table
-    psm_file = config.output_dir / "psm_clean.csv"
-    df.to_csv(psm_file, index=False)
+    psm_file = config.output_dir / "psm_clean.parquet"
+    write_parquet(df, psm_file)
     file_size_mb = psm_file.stat().st_size / 1e6
     print(f"✅ {psm_file.name} ({file_size_mb:.1f} MB)")
     
     # Chimeric PSMs only
-    chimeric_file = config.output_dir / "psm_chimeric.csv"
+    chimeric_file = config.output_dir / "psm_chimeric.parquet"
     df_chimeric = df[df['is_chimeric']]
-    df_chimeric.to_csv(chimeric_file, index=False)
+    write_parquet(df_chimeric, chimeric_file)
     print(f"✅ {chimeric_file.name} ({len(df_chimeric):,} PSMs)")
     
-    # Spectrum to file mapping
-    spectrum_to_file = df.groupby('spectrum_key')['mzml_name'].first().to_dict()
-    mapping_file = config.output_dir / "spectrum_to_file.pkl"
-    with open(mapping_file, 'wb') as f:
-        pickle.dump(spectrum_to_file, f)
-    print(f"✅ {mapping_file.name} ({len(spectrum_to_file):,} spectra)")
+    # Optional CSV copies (legacy consumers)
+    if config.write_csv:
+        for table, path in [(df, psm_file), (df_chimeric, chimeric_file)]:
+            csv_file = path.with_suffix('.csv')
+            table.to_csv(csv_file, index=False)
+            print(f"✅ {csv_file.name}")
+    
+    # Spectrum to file mapping (2 columns: spectrum_key, mzml_name)
+    # Load as: pd.read_parquet(path).set_index('spectrum_key')['mzml_name']
+    mapping = (
+        df[['spectrum_key', 'mzml_name']]
+        .dropna(subset=['spectrum_key'])
+        .drop_duplicates('spectrum_key', keep='first')
+    )
+    mapping_file = config.output_dir / "spectrum_to_file.parquet"
+    mapping.to_parquet(mapping_file, engine='pyarrow', compression='zstd', index=False)
+    print(f"✅ {mapping_file.name} ({len(mapping):,} spectra)")
     
     # Summary statistics
     stats_file = config.output_dir / "psm_stats.pkl"
@@ -378,6 +472,37 @@ def save_outputs(df: pd.DataFrame, config: Config, summary: Dict) -> None:
 # PSM DIRECTORY FINDER
 # ============================================================
 
+@functools.lru_cache(maxsize=None)
+def list_psm_tsv(root: Path) -> Tuple[Path, ...]:
+    """
+    Find all psm.tsv files under root in a single (memoized) scan.
+    
+    Uses os.scandir and never descends into 'lib' directories, so
+    find_psm_directory() and main() share one walk of the tree.
+    
+    Args:
+        root: Directory to scan
+        
+    Returns:
+        Sorted tuple of psm.tsv paths
+    """
+    found = []
+    stack = [os.fspath(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != 'lib':
+                        stack.append(entry.path)
+                elif entry.name == 'psm.tsv':
+                    found.append(Path(entry.path))
+    return tuple(sorted(found))
+
+
 def find_psm_directory(config: Config) -> Optional[Path]:
     """
     Find the directory containing PSM files.
@@ -397,8 +522,7 @@ def find_psm_directory(config: Config) -> Optional[Path]:
     
     for path in search_paths:
         if path.exists():
-            psm_files = list(path.rglob("psm.tsv"))
-            if psm_files:
+            if list_psm_tsv(path):
                 return path
     
     return None
@@ -429,6 +553,11 @@ def main():
         type=str,
         help='Path to directory containing mzML files (in SCRATCH)'
     )
+    parser.add_argument(
+        '--csv',
+        action='store_true',
+        help='Also write psm_clean.csv / psm_chimeric.csv'
+    )
     parser.add_argument(
         '--dry-run',
         action='store_true',
@@ -439,6 +568,7 @@ def main():
     # Initialize configuration
     config = Config.auto_detect()
     config.n_cores = args.cores
+    config.write_csv = args.csv
     
     if args.psm_dir:
         config.psm_dir = Path(args.psm_dir)
@@ -473,10 +603,7 @@ def main():
     print(f"PSM dir: {config.psm_dir}")
     
     # Find PSM files
-    psm_files = [
-        f for f in config.psm_dir.rglob("psm.tsv")
-        if 'lib' not in f.parts
-    ]
+    psm_files = list(list_psm_tsv(config.psm_dir))
     print(f"\nFound {len(psm_files)} PSM files")
     
     # Show sample folders
@@ -494,16 +621,22 @@ def main():
     print(f"\nLoading with {config.n_cores} cores...")
     start_time = time.time()
     
-    with Pool(config.n_cores) as pool:
-        results = pool.map(load_single_psm_file, psm_files)
-    
-    # Filter out None results
-    dataframes = [df for df in results if df is not None]
-    print(f"Successfully loaded {len(dataframes)} files")
-    
-    # Concatenate all dataframes
-    print("Concatenating dataframes...")
-    df_all = pd.concat(dataframes, ignore_index=True)
+    # Stream results in input order (deterministic row order); recycle
+    # workers to return memory to the OS
+    tables = []
+    with Pool(config.n_cores, maxtasksperchild=8) as pool:
+        for table in pool.imap(load_single_psm_file, psm_files, chunksize=4):
+            if table is not None:
+                tables.append(table)
+    
+    print(f"Successfully loaded {len(tables)} files")
+    
+    # Concatenate all tables (zero-copy chunk chaining)
+    print("Concatenating tables...")
+    table = pa.concat_tables(tables, promote_options='permissive')
+    del tables
+    df_all = table.to_pandas(self_destruct=True, split_blocks=True)
+    del table
     
     load_time = time.time() - start_time
     print(f"Loaded {len(df_all):,} PSMs in {load_time:.1f}s")
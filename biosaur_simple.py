@@ -14,7 +14,9 @@ Usage:
 import os
 import subprocess
 import sys
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 
@@ -32,9 +34,139 @@ BIOSAUR_CMD = os.environ.get(
     "/data/antwerpen/211/vsc21150/Exploring-Fragmentation-Competion-in-Proteomics-Data-to-Decode-Chimeric-Spectra/.venv/bin/biosaur2"
 )
 
+# String forms used in every biosaur2 argv / output path (built once)
+OUT_DIR_STR = str(OUT_DIR)
+OUT_PREFIX = os.path.join(OUT_DIR_STR, "")
+
 # Processing parameters
 NUM_PROCESSES = 4  # Cores per file
 
+# Constant parts of every biosaur2 command line (only -i varies per file)
+_BIO_PREFIX = [BIOSAUR_CMD, "-i"]
+_BIO_SUFFIX = ["-o", OUT_DIR_STR, "-p", str(NUM_PROCESSES)]
+
+# Only the end of biosaur2's stderr is ever reported
+STDERR_TAIL_BYTES = 4096
+
+# Progress lines are flushed every N lines (and before each biosaur2 run)
+PROGRESS_FLUSH_EVERY = 16
+
+
+# ============================================================================
+# SUBPROCESS
+# ============================================================================
+
+def run_quiet(argv: list[str], timeout=None) -> tuple[int, bytes]:
+    """
+    Run a command discarding stdout and keeping only the last
+    STDERR_TAIL_BYTES of stderr in memory (instead of capture_output).
+    
+    A non-zero exit is reported through the return value rather than a
+    CalledProcessError, so callers check the returncode explicitly.
+    
+    Returns:
+        (returncode, stderr tail)
+    
+    Raises:
+        subprocess.TimeoutExpired: timeout exceeded (child is killed)
+    """
+    tail = bytearray()
+    
+    with subprocess.Popen(
+        argv,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        close_fds=False  # lets CPython use posix_spawn (no fork of a big parent)
+    ) as proc:
+        def drain():
+            try:
+                for chunk in iter(lambda: proc.stderr.read(4096), b""):
+                    tail.extend(chunk)
+                    del tail[:-STDERR_TAIL_BYTES]
+            except (OSError, ValueError):
+                pass
+        
+        reader = threading.Thread(target=drain, daemon=True)
+        reader.start()
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise
+        reader.join()
+    
+    return proc.returncode, bytes(tail)
+
+
+# ============================================================================
+# OUTPUT SCAN
+# ============================================================================
+
+def scan_done_outputs(out_dir, min_size: int = 1000) -> set[str]:
+    """
+    Names of finished *.features.tsv outputs (larger than min_size bytes)
+    from one os.scandir pass; skipping is then a set difference.
+    """
+    with os.scandir(out_dir) as it:
+        return {
+            e.name for e in it
+            if e.name.endswith(".features.tsv") and e.stat().st_size > min_size
+        }
+
+
+# ============================================================================
+# FEATURE COUNTING
+# ============================================================================
+
+def count_lines(path) -> int:
+    """
+    Count lines like `sum(1 for _ in open(path))`, but in 1 MiB binary
+    chunks with bytes.count (C memchr) instead of a Python-level loop.
+    Reads go into one reused buffer, with sequential readahead hinted.
+    """
+    n = 0
+    last = ord("\n")
+    buf = bytearray(1 << 20)
+    with open(path, "rb", buffering=0) as fh:
+        # Ask the kernel for aggressive readahead on this sequential scan
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            size = fh.readinto(buf)
+            if not size:
+                break
+            n += buf.count(b"\n", 0, size)
+            last = buf[size - 1]
+    # Final line without trailing newline still counts
+    return n + (last != ord("\n"))
+
+
+def count_features(path) -> int:
+    """Feature rows in one .features.tsv (header excluded, 0 if unreadable)."""
+    try:
+        return count_lines(path) - 1
+    except OSError:
+        return 0
+
+
+# ============================================================================
+# PROGRESS OUTPUT
+# ============================================================================
+
+class ProgressWriter:
+    """Block-buffered "[i/N] message" lines with a pre-built "/N] " suffix."""
+    
+    def __init__(self, total: int):
+        self.suffix = f"/{total}] "
+        self.pending = 0
+    
+    def __call__(self, i: int, *parts: str, flush: bool = False) -> None:
+        sys.stdout.write("".join(("[", str(i), self.suffix, *parts, "\n")))
+        self.pending += 1
+        if flush or self.pending >= PROGRESS_FLUSH_EVERY:
+            sys.stdout.flush()
+            self.pending = 0
+
 
 # ============================================================================
 # MAIN PROCESSING
@@ -65,63 +197,68 @@ def main():
         print("  2. Or set: export BIOSAUR_CMD=/path/to/biosaur2")
         sys.exit(1)
     
-    # Get list of mzML files
-    mzml_files = sorted(MZML_DIR.glob("*.mzML"))
-    if not mzml_files:
+    # Get list of mzML files as ready-made (name, mzML path, output name,
+    # output path) string tuples; nothing is rebuilt inside the loop
+    with os.scandir(MZML_DIR) as it:
+        work = sorted(
+            (e.name, e.path, out_name, OUT_PREFIX + out_name)
+            for e in it if e.name.endswith(".mzML")
+            for out_name in (e.name[:-len(".mzML")] + ".features.tsv",)
+        )
+    if not work:
         print(f"❌ ERROR: No mzML files found in {MZML_DIR}")
         sys.exit(1)
     
-    print(f"Found {len(mzml_files)} mzML files to process\n")
+    print(f"Found {len(work)} mzML files to process\n")
+    
+    # Skip already processed files: one directory listing, one set lookup
+    # per file
+    done = scan_done_outputs(OUT_DIR)
+    todo = [task for task in work if task[2] not in done]
+    skip_count = len(work) - len(todo)
+    print(f"⏭️  Skipping {skip_count} files (already done)\n")
     
     # Process each file
     success_count = 0
-    skip_count = 0
     fail_count = 0
     
-    for i, mzml_file in enumerate(mzml_files, 1):
-        output_file = OUT_DIR / f"{mzml_file.stem}.features.tsv"
-        
-        # Skip if already processed
-        if output_file.exists() and output_file.stat().st_size > 1000:
-            print(f"[{i}/{len(mzml_files)}] ⏭️  SKIP: {mzml_file.name} (already done)")
-            skip_count += 1
-            continue
-        
-        print(f"[{i}/{len(mzml_files)}] 🔄 Processing: {mzml_file.name}")
+    # Progress lines are block-buffered (flushed before each biosaur2 run)
+    sys.stdout.reconfigure(line_buffering=False)
+    progress = ProgressWriter(len(todo))
+    
+    for i, (name, mzml_file, out_name, output_file) in enumerate(todo, 1):
+        # Flush so the line is visible while biosaur2 runs
+        progress(i, "🔄 Processing: ", name, flush=True)
         
         try:
             # Run biosaur2
-            subprocess.run(
-                [
-                    BIOSAUR_CMD,
-                    "-i", str(mzml_file),
-                    "-o", str(OUT_DIR),
-                    "-p", str(NUM_PROCESSES)
-                ],
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            returncode, err = run_quiet([*_BIO_PREFIX, mzml_file, *_BIO_SUFFIX])
+            if returncode:
+                progress(i, "❌ FAILED: ", name)
+                if err:
+                    print(f"    Error: {err[-200:].decode(errors='replace')}")
+                fail_count += 1
+                continue
             
             # Verify output
-            if output_file.exists() and output_file.stat().st_size > 100:
-                print(f"[{i}/{len(mzml_files)}] ✅ SUCCESS: {mzml_file.name}")
+            try:
+                output_ok = os.stat(output_file).st_size > 100
+            except OSError:
+                output_ok = False
+            if output_ok:
+                progress(i, "✅ SUCCESS: ", name)
                 success_count += 1
             else:
-                print(f"[{i}/{len(mzml_files)}] ❌ FAILED: {mzml_file.name} (empty output)")
+                progress(i, "❌ FAILED: ", name, " (empty output)")
                 fail_count += 1
                 
-        except subprocess.CalledProcessError as e:
-            print(f"[{i}/{len(mzml_files)}] ❌ FAILED: {mzml_file.name}")
-            if e.stderr:
-                print(f"    Error: {e.stderr[:200]}")
-            fail_count += 1
-            
         except Exception as e:
-            print(f"[{i}/{len(mzml_files)}] ❌ FAILED: {mzml_file.name}")
+            progress(i, "❌ FAILED: ", name)
             print(f"    Exception: {str(e)[:200]}")
             fail_count += 1
     
+    sys.stdout.flush()
+    
     # Summary
     print("\n" + "=" * 70)
     print("SUMMARY")
@@ -134,13 +271,9 @@ def main():
     # Count total features
     try:
         feature_files = list(OUT_DIR.glob("*.features.tsv"))
-        total_features = 0
-        for f in feature_files:
-            try:
-                with open(f) as fh:
-                    total_features += sum(1 for _ in fh) - 1  # Subtract header
-            except:
-                pass
+        # I/O bound (read() releases the GIL): overlap reads across files
+        with ThreadPoolExecutor(max_workers=16) as ex:
+            total_features = sum(ex.map(count_features, feature_files))
         print(f"📊 Total features extracted: {total_features:,}")
     except:
         pass
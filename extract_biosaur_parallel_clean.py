@@ -6,19 +6,38 @@ Production-ready parallel Biosaur2 feature extraction.
 
 Usage:
     python3 extract_biosaur_parallel.py
+    python3 extract_biosaur_parallel.py --xargs   # hand the work to xargs -P
 
 Requirements:
-    - biosaur2 installed
+    - biosaur2 installed (importable from the same venv as
+      Config.BIOSAUR_CMD -> run in-process by pre-warmed workers;
+      otherwise Config.BIOSAUR_CMD is launched per file)
     - mzML files in /scratch/.../PXD037527/mzML/
     
 Output:
     - Features in /scratch/.../PXD037527/biosaur_features/
 """
 
+import argparse
+import ctypes
+import heapq
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
 from pathlib import Path
-from multiprocessing import Pool, cpu_count
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import active_children, cpu_count, get_context
 from datetime import datetime
 import time
 
@@ -40,60 +59,386 @@ class Config:
     # Parallelization
     CORES_PER_FILE = 8
     N_PARALLEL = 4  # Process 4 files simultaneously
+    MAX_TASKS_PER_WORKER = 8  # Recycle workers to bound RSS (Python >= 3.11)
+    PIN_CPUS = True  # Pin each running file to its own CORES_PER_FILE CPUs
     
     # Biosaur2 parameters
     MIN_INTENSITY = 1000  # Skip low signals for speed
+    FILE_TIMEOUT = 7200  # 2 hour limit per file (subprocess or in-process)
+    
+    # Node-local staging for biosaur2's .features.tsv writes; finished files
+    # are copied to OUT_DIR in one pass and renamed into place (None = write
+    # straight to OUT_DIR)
+    STAGE_DIR = Path(
+        os.environ.get("TMPDIR") or tempfile.gettempdir()
+    ) / f"biosaur_stage_{os.getuid()}"
+    
+    # --xargs mode: work list written here, then executed by xargs
+    MANIFEST = OUT_DIR / "biosaur_work.jsonl"
+    
+    # Checkpoint of completed files (JSONL), rewritten every N successes
+    STATE_FILE = OUT_DIR / "state.jsonl"
+    CHECKPOINT_EVERY = 4
+
+
+# Only the end of biosaur2's stderr is ever reported
+STDERR_TAIL_BYTES = 4096
+
+# Constant parts of every biosaur2 command line; only the input and output
+# paths are filled in per file
+_BIO_PREFIX = [Config.BIOSAUR_CMD]
+_BIO_SUFFIX = [
+    "-nprocs", str(Config.CORES_PER_FILE),
+    "-mini", str(Config.MIN_INTENSITY)
+]
+
+
+# ============================================================================
+# OUTPUT SCAN
+# ============================================================================
+
+def scan_done_outputs(out_dir, min_size: int = 1000) -> set[str]:
+    """
+    Names of finished *.features.tsv outputs (larger than min_size bytes)
+    from one os.scandir pass.
+    
+    The skip decision becomes a set lookup in the driver: already-done files
+    are never stat'ed per input mzML nor sent to a worker.
+    """
+    with os.scandir(out_dir) as it:
+        return {
+            e.name for e in it
+            if e.name.endswith(".features.tsv") and e.stat().st_size > min_size
+        }
+
+
+def biosaur_in_process() -> bool:
+    """
+    Whether workers may import biosaur2 instead of launching BIOSAUR_CMD.
+    
+    Only when this interpreter can import biosaur2 and BIOSAUR_CMD lives
+    in this interpreter's own environment (<prefix>/bin/biosaur2); a
+    BIOSAUR_CMD from another venv is always run as a subprocess so its
+    biosaur2 version is the one used.
+    """
+    if importlib.util.find_spec("biosaur2") is None:
+        return False
+    cmd_prefix = Path(Config.BIOSAUR_CMD).resolve().parent.parent
+    return cmd_prefix == Path(sys.prefix).resolve()
 
 
 # ============================================================================
 # WORKER FUNCTION
 # ============================================================================
 
-def process_single_file(mzml_file: Path) -> tuple[str, bool, str]:
+# biosaur2 entry point, imported once per worker by _init_worker()
+# (None -> fall back to launching Config.BIOSAUR_CMD as a subprocess)
+_biosaur_run = None
+
+# One shared entry per parallel slot: 0 = free, else (task id + 1) of the
+# file running there; the slot index also selects the CPU block ([] -> no
+# pinning). Set by _init_worker(); _slot is this worker's current slot.
+_slots = None
+_cpu_blocks: list[list[int]] = []
+_slot = None
+
+
+# Shared count of files started so far (across all workers) and the total,
+# set by _init_worker(); lets workers announce each file as it begins
+_started = None
+_n_total = 0
+
+
+def _init_worker(started=None, n_total: int = 0, slots=None,
+                 cpu_blocks: list[list[int]] = (),
+                 in_process: bool = True) -> None:
+    """Import biosaur2 once per long-lived worker process."""
+    global _biosaur_run, _started, _n_total, _slots, _cpu_blocks
+    # Own process group, so the driver can stop this worker together with
+    # everything biosaur2 starts (see _kill_workers)
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, _on_pool_terminate)
+    _started = started
+    _n_total = n_total
+    _slots = slots
+    _cpu_blocks = list(cpu_blocks)
+    # biosaur2's run() calls logging.basicConfig(level=INFO); with a root
+    # handler already installed that is a no-op, so only warnings and errors
+    # from the in-process runs reach the console
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(levelname)s [%(processName)s] %(message)s"
+    )
+    _biosaur_run = None
+    if in_process:
+        try:
+            from biosaur2.search import run
+            _biosaur_run = run
+        except ImportError:
+            pass
+
+
+def run_quiet(argv: list[str], timeout=None) -> tuple[int, bytes]:
+    """
+    Run a command discarding stdout and keeping only the last
+    STDERR_TAIL_BYTES of stderr in memory (instead of capture_output).
+    
+    A non-zero exit is reported through the return value rather than a
+    CalledProcessError, so callers check the returncode explicitly.
+    
+    Returns:
+        (returncode, stderr tail)
+    
+    Raises:
+        subprocess.TimeoutExpired: timeout exceeded (child is killed)
+    """
+    tail = bytearray()
+    
+    with subprocess.Popen(
+        argv,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        close_fds=False  # lets CPython use posix_spawn (no fork of a big parent)
+    ) as proc:
+        def drain():
+            try:
+                for chunk in iter(lambda: proc.stderr.read(4096), b""):
+                    tail.extend(chunk)
+                    del tail[:-STDERR_TAIL_BYTES]
+            except (OSError, ValueError):
+                pass
+        
+        reader = threading.Thread(target=drain, daemon=True)
+        reader.start()
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise
+        reader.join()
+    
+    return proc.returncode, bytes(tail)
+
+
+def _claim_slot(task_id: int):
+    """
+    Record task_id in a free slot and pin this worker to that slot's CPU
+    block (if pinning is on).
+    
+    Slots are claimed per file rather than per worker, so recycled workers
+    (MAX_TASKS_PER_WORKER) never end up sharing a block. biosaur2's threads
+    and child processes inherit the affinity mask. A slot still holding a
+    task id after the pool broke names the file whose worker crashed.
+    
+    Returns:
+        Index of the claimed slot, or None without shared slots
+    """
+    global _slot
+    if _slots is None:
+        return None
+    with _slots.get_lock():
+        for i, busy in enumerate(_slots):
+            if not busy:
+                _slots[i] = task_id + 1
+                break
+        else:
+            return None
+    _slot = i
+    if _cpu_blocks:
+        os.sched_setaffinity(0, _cpu_blocks[i])
+    return i
+
+
+def _release_slot(i) -> None:
+    """Free a slot taken by _claim_slot()."""
+    global _slot
+    if i is not None:
+        with _slots.get_lock():
+            _slots[i] = 0
+        _slot = None
+
+
+def _on_pool_terminate(signum, frame):
+    """
+    SIGTERM from ProcessPoolExecutor after another worker crashed: vacate
+    the slot, so this file is re-queued rather than blamed, and take
+    biosaur2's children down together with this worker.
+    """
+    _release_slot(_slot)
+    os.killpg(os.getpgrp(), signal.SIGKILL)
+
+
+def plan_cpu_blocks() -> list[list[int]]:
+    """
+    Split the CPUs available to this process into N_PARALLEL contiguous
+    blocks of CORES_PER_FILE, keeping each file's threads close together.
+    
+    Returns:
+        One CPU list per parallel slot; [] if pinning is disabled,
+        unsupported, or there are too few CPUs
+    """
+    if not Config.PIN_CPUS or not hasattr(os, "sched_setaffinity"):
+        return []
+    cpus = sorted(os.sched_getaffinity(0))
+    n = Config.CORES_PER_FILE
+    if len(cpus) < Config.N_PARALLEL * n:
+        return []
+    return [cpus[i * n:(i + 1) * n] for i in range(Config.N_PARALLEL)]
+
+
+def _report_start(name: str, block) -> None:
+    """Bump the shared started-files counter and print a "started" line."""
+    if _started is None:
+        return
+    with _started.get_lock():
+        _started.value += 1
+        n = _started.value
+    where = f" on CPUs {_cpu_blocks[block][0]}-{_cpu_blocks[block][-1]}" \
+        if block is not None and _cpu_blocks else ""
+    # One write per line so lines from concurrent processes do not interleave
+    sys.stdout.write(f"  ▶ started {n}/{_n_total}: {name}{where}\n")
+    sys.stdout.flush()
+
+
+def _malloc_trim() -> None:
+    """Return freed heap arenas to the OS (glibc only; no-op elsewhere)."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _alarm_timeout(signum, frame):
+    """SIGALRM watchdog for in-process runs: abandon the current file."""
+    # Re-arm in case biosaur2 swallows this one in a bare except
+    signal.alarm(60)
+    raise subprocess.TimeoutExpired("biosaur2", Config.FILE_TIMEOUT)
+
+
+def _run_biosaur_inprocess(argv: list[str]) -> None:
     """
-    Process a single mzML file with Biosaur2.
+    Run biosaur2 inside the current (pre-warmed) interpreter, under a
+    FILE_TIMEOUT SIGALRM watchdog.
+    
+    The alarm interrupts blocking waits such as biosaur2 collecting results
+    from its -nprocs children (a hang if one of them died); its children are
+    then killed so the worker is free for the next file.
+    
+    Raises:
+        RuntimeError: if biosaur2 exits with a non-zero status
+        subprocess.TimeoutExpired: FILE_TIMEOUT exceeded
+    """
+    saved_argv = sys.argv
+    sys.argv = ["biosaur2"] + argv
+    previous = signal.signal(signal.SIGALRM, _alarm_timeout)
+    signal.alarm(Config.FILE_TIMEOUT)
+    try:
+        _biosaur_run()
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError(f"biosaur2 exited with status {e.code}")
+    except subprocess.TimeoutExpired:
+        for child in active_children():
+            child.kill()
+            child.join()
+        raise
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+        sys.argv = saved_argv
+
+
+def process_single_file(task: tuple[str, str, str, str],
+                        task_id: int = -1) -> tuple[str, bool, str]:
+    """
+    Process a single mzML file with Biosaur2 on its own CPU block, then
+    trim the worker heap.
     
     Args:
-        mzml_file: Path to input mzML file
+        task: (mzML name, mzML path, output name, output path) as plain
+              strings, all resolved once by the driver
+        task_id: driver-side id, kept in a shared slot while running
         
     Returns:
         (filename, success, message)
     """
-    output_file = Config.OUT_DIR / f"{mzml_file.stem}.features.tsv"
-    
-    # Skip if already exists and not empty
-    if output_file.exists() and output_file.stat().st_size > 1000:
-        return (mzml_file.name, True, "SKIP")
+    slot = _claim_slot(task_id)
+    _report_start(task[0], slot)
+    try:
+        return _process_single_file(*task)
+    finally:
+        _release_slot(slot)
+        _malloc_trim()
+
+
+def _publish(staged: str, output_file: str) -> None:
+    """
+    Move a staged output into OUT_DIR: one large sequential copy to a
+    .part file, then an atomic rename, so the shared filesystem never sees
+    biosaur2's small incremental writes or a half-written .features.tsv.
+    """
+    part = output_file + ".part"
+    shutil.copyfile(staged, part)
+    os.replace(part, output_file)
+
+
+def _process_single_file(
+    name: str, mzml_file: str, out_name: str, output_file: str
+) -> tuple[str, bool, str]:
+    """Run Biosaur2 for one pending mzML file (done files never get here)."""
+    if Config.STAGE_DIR is not None:
+        target = os.path.join(Config.STAGE_DIR, out_name)
+    else:
+        target = output_file
+    try:
+        result = _run_biosaur(name, mzml_file, target)
+        if result[1] and target != output_file:
+            _publish(target, output_file)
+        return result
+    except Exception as e:
+        return (name, False, f"EXCEPTION: {str(e)[:200]}")
+    finally:
+        if target != output_file:
+            try:
+                os.unlink(target)
+            except FileNotFoundError:
+                pass
+
+
+def _run_biosaur(name: str, mzml_file: str, output_file: str) -> tuple[str, bool, str]:
+    """Run Biosaur2 on one mzML file, writing features to output_file."""
+    argv = [mzml_file, "-o", output_file, *_BIO_SUFFIX]
     
     try:
-        # Run Biosaur2 with correct parameters
-        result = subprocess.run(
-            [
-                Config.BIOSAUR_CMD,
-                str(mzml_file),
-                "-o", str(output_file),
-                "-nprocs", str(Config.CORES_PER_FILE),
-                "-mini", str(Config.MIN_INTENSITY)
-            ],
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=7200  # 2 hour timeout per file
-        )
+        if _biosaur_run is not None:
+            # Reuse the already-imported biosaur2 (no interpreter startup)
+            _run_biosaur_inprocess(argv)
+        else:
+            # Run Biosaur2 with correct parameters
+            returncode, err = run_quiet(
+                _BIO_PREFIX + argv,
+                timeout=Config.FILE_TIMEOUT
+            )
+            if returncode:
+                error_msg = (
+                    err[-200:].decode(errors="replace") if err else "Unknown error"
+                )
+                return (name, False, f"ERROR: {error_msg}")
         
         # Verify output exists
-        if output_file.exists() and output_file.stat().st_size > 100:
-            return (mzml_file.name, True, "OK")
+        try:
+            output_ok = os.stat(output_file).st_size > 100
+        except OSError:
+            output_ok = False
+        if output_ok:
+            return (name, True, "OK")
         else:
-            return (mzml_file.name, False, "Output file empty or missing")
+            return (name, False, "Output file empty or missing")
             
     except subprocess.TimeoutExpired:
-        return (mzml_file.name, False, "TIMEOUT (>2h)")
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr[:200] if e.stderr else "Unknown error"
-        return (mzml_file.name, False, f"ERROR: {error_msg}")
+        return (name, False, f"TIMEOUT (>{Config.FILE_TIMEOUT}s)")
     except Exception as e:
-        return (mzml_file.name, False, f"EXCEPTION: {str(e)[:200]}")
+        return (name, False, f"EXCEPTION: {str(e)[:200]}")
 
 
 # ============================================================================
@@ -110,17 +455,23 @@ def validate_setup() -> bool:
     if not Config.MZML_DIR.exists():
         errors.append(f"mzML directory not found: {Config.MZML_DIR}")
     else:
-        mzml_files = list(Config.MZML_DIR.glob("*.mzML"))
-        if not mzml_files:
+        # Existence only (stops at the first match); main() does the full
+        # listing once and reports the count
+        with os.scandir(Config.MZML_DIR) as it:
+            has_mzml = any(e.name.endswith(".mzML") for e in it)
+        if not has_mzml:
             errors.append(f"No mzML files in: {Config.MZML_DIR}")
         else:
-            print(f"  ✓ Found {len(mzml_files)} mzML files")
+            print(f"  ✓ mzML files present")
     
     # Check biosaur2
     if not Path(Config.BIOSAUR_CMD).exists():
         errors.append(f"Biosaur2 not found: {Config.BIOSAUR_CMD}")
+    elif biosaur_in_process():
+        origin = Path(importlib.util.find_spec("biosaur2").origin).parent
+        print(f"  ✓ Biosaur2 in-process: {origin}")
     else:
-        print(f"  ✓ Biosaur2 found")
+        print(f"  ✓ Biosaur2 as subprocess: {Config.BIOSAUR_CMD}")
     
     # Create output directory
     try:
@@ -140,13 +491,216 @@ def validate_setup() -> bool:
     return True
 
 
+# ============================================================================
+# XARGS MODE
+# ============================================================================
+
+def write_manifest(tasks: list[tuple[str, str, str, str]], path: Path) -> Path:
+    """
+    Write the pending work as JSONL ({"mzml", "out"} per line) plus a
+    NUL-delimited "mzml\\0out\\0" copy that xargs can consume safely.
+    
+    Only the NUL-delimited file is read (by xargs); the JSONL is a
+    human-readable record of what was handed over.
+    
+    Returns:
+        Path of the NUL-delimited argument file
+    """
+    args_path = path.with_suffix(".args0")
+    with open(path, "w") as jf, open(args_path, "w") as af:
+        for _, mzml_file, _, output_file in tasks:
+            jf.write(json.dumps({"mzml": mzml_file, "out": output_file}) + "\n")
+            af.write(f"{mzml_file}\0{output_file}\0")
+    return args_path
+
+
+def exec_xargs(tasks: list[tuple[str, str, str, str]]) -> None:
+    """
+    Replace this process with `xargs -P N_PARALLEL` running biosaur2 on
+    every task, so each biosaur2 launch is forked from the tiny xargs
+    process rather than from a Python parent. Does not return.
+    
+    Each run writes "<out>.part", renamed to <out> only when biosaur2
+    exits 0, so an interrupted run never leaves an output that the next
+    run would take as done. xargs exits 0 when every run succeeded and
+    123 if any run failed; there is no per-file summary in this mode.
+    """
+    args_path = write_manifest(tasks, Config.MANIFEST)
+    print(f"Manifest: {Config.MANIFEST} ({len(tasks)} files)")
+    print(f"Handing over to xargs -P {Config.N_PARALLEL}...", flush=True)
+    os.execvp("xargs", [
+        # -r: with nothing pending, run nothing (GNU xargs would otherwise
+        # start biosaur2 once with empty paths)
+        "xargs", "-r", "-0", "-a", str(args_path), "-n", "2",
+        "-P", str(Config.N_PARALLEL),
+        "sh", "-c",
+        '"$0" "$1" -o "$2.part" ' + " ".join(_BIO_SUFFIX)
+        + ' && exec mv -f "$2.part" "$2"; rc=$?; rm -f "$2.part"; exit $rc',
+        *_BIO_PREFIX
+    ])
+
+
+# ============================================================================
+# FEATURE COUNTING
+# ============================================================================
+
+def count_lines(path) -> int:
+    """
+    Count lines like `sum(1 for _ in open(path))`, but in 1 MiB binary
+    chunks with bytes.count (C memchr) instead of a Python-level loop.
+    Reads go into one reused buffer, with sequential readahead hinted.
+    """
+    n = 0
+    last = ord("\n")
+    buf = bytearray(1 << 20)
+    with open(path, "rb", buffering=0) as fh:
+        # Ask the kernel for aggressive readahead on this sequential scan
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            size = fh.readinto(buf)
+            if not size:
+                break
+            n += buf.count(b"\n", 0, size)
+            last = buf[size - 1]
+    # Final line without trailing newline still counts
+    return n + (last != ord("\n"))
+
+
+def count_features(path) -> int:
+    """Feature rows in one .features.tsv (header excluded, 0 if unreadable)."""
+    try:
+        return count_lines(path) - 1
+    except OSError:
+        return 0
+
+
+# ============================================================================
+# CHECKPOINT
+# ============================================================================
+
+def load_checkpoint(path: Path) -> set[str]:
+    """Stems recorded as completed in a previous run's state file."""
+    stems = set()
+    try:
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    stems.add(json.loads(line)["stem"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # tolerate a damaged line
+    except FileNotFoundError:
+        pass
+    return stems
+
+
+class Checkpoint:
+    """
+    Stems of successfully processed files, persisted to Config.STATE_FILE
+    every `every` new successes (and on save()).
+    
+    The file is rewritten via a temporary file and os.replace(), so a run
+    killed mid-write (e.g. SLURM wall-time SIGTERM) leaves the previous
+    checkpoint intact.
+    """
+    
+    def __init__(self, path: Path, every: int):
+        self.path = path
+        self.every = every
+        self.stems = load_checkpoint(path)
+        self.unsaved = 0
+    
+    def record(self, result: tuple[str, bool, str]) -> None:
+        filename, success, message = result
+        if not (success and message == "OK"):
+            return
+        self.stems.add(filename[:-len(".mzML")])
+        self.unsaved += 1
+        if self.unsaved >= self.every:
+            self.save()
+    
+    def save(self) -> None:
+        if not self.unsaved:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as fh:
+            fh.writelines(
+                json.dumps({"stem": stem}) + "\n" for stem in sorted(self.stems)
+            )
+        os.replace(tmp, self.path)
+        self.unsaved = 0
+
+
+def _kill_workers(pool: ProcessPoolExecutor) -> None:
+    """
+    Kill every pool worker and its biosaur2 children right away.
+    
+    A biosaur2 run outlasts any scheduler grace period, so on SIGTERM or
+    Ctrl+C the driver does not wait for files already in progress. Their
+    outputs are staged, so nothing half-written reaches OUT_DIR.
+    """
+    # ProcessPoolExecutor has no public way to stop running workers
+    # (terminate_workers() needs Python >= 3.14 and spares their children)
+    for proc in list((pool._processes or {}).values()):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            proc.kill()  # not yet in its own group
+
+
+def _kill_process_groups(pids) -> None:
+    """SIGKILL whatever is left of the given workers' process groups."""
+    for pid in pids:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class Terminated(BaseException):
+    """
+    Raised in the driver on SIGTERM.
+    
+    Deliberately not a SystemExit: in-process biosaur2 runs treat SystemExit
+    as biosaur2's own exit status, which would turn the signal into a
+    failed file and carry on.
+    """
+
+
+def _raise_on_sigterm(signum, frame):
+    """Turn SIGTERM into Terminated so checkpoints are saved on the way out."""
+    # Repeated SIGTERMs (e.g. srun signalling every task) must not interrupt
+    # the unwinding itself
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise Terminated()
+
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
+def print_progress(i: int, total: int, result: tuple[str, bool, str]) -> None:
+    """Print one completed result as soon as it arrives."""
+    filename, success, message = result
+    status = "✅" if success else "❌"
+    sys.stdout.write(f"[{i}/{total}] {status} {filename:<60} {message}\n")
+    sys.stdout.flush()
+
+
 def main():
     """Main execution function."""
     
+    parser = argparse.ArgumentParser(
+        description="Parallel Biosaur2 feature extraction"
+    )
+    parser.add_argument(
+        "--xargs",
+        action="store_true",
+        help="Write a JSONL work manifest and exec xargs -P instead of "
+             "running a Python worker pool"
+    )
+    args = parser.parse_args()
+    
     print("=" * 70)
     print("BIOSAUR2 PARALLEL FEATURE EXTRACTION")
     print("=" * 70)
@@ -162,33 +716,187 @@ def main():
     if not validate_setup():
         sys.exit(1)
     
-    # Get list of mzML files
-    mzml_files = sorted(Config.MZML_DIR.glob("*.mzML"))
-    print(f"Processing {len(mzml_files)} files...")
-    print()
+    # Finished outputs: a single directory listing, plus files the previous
+    # run recorded as completed before it was stopped
+    checkpoint = Checkpoint(Config.STATE_FILE, Config.CHECKPOINT_EVERY)
+    done = scan_done_outputs(Config.OUT_DIR)
+    done.update(stem + ".features.tsv" for stem in checkpoint.stems)
     
-    # Process in parallel
-    start_time = time.time()
+    # A wall-time SIGTERM unwinds like Ctrl+C, saving the checkpoint
+    signal.signal(signal.SIGTERM, _raise_on_sigterm)
     
-    with Pool(processes=Config.N_PARALLEL) as pool:
-        results = pool.map(process_single_file, mzml_files)
+    # Get list of mzML files (one scandir, no per-entry Path globbing) as a
+    # max-heap on file size: the scheduler always hands out the largest
+    # pending file next (online LPT), so long jobs start early and short
+    # ones fill the tail instead of leaving cores idle at the end.
+    # Each entry carries its complete task as plain strings, built once here
+    # (no per-file Path objects in the driver or the workers).
+    out_prefix = os.path.join(Config.OUT_DIR, "")
+    # Files whose output is already done are dropped here by a set lookup.
+    n_found = 0
+    heap = []
+    with os.scandir(Config.MZML_DIR) as it:
+        for e in it:
+            if not e.name.endswith(".mzML"):
+                continue
+            n_found += 1
+            out_name = e.name[:-len(".mzML")] + ".features.tsv"
+            if out_name not in done:
+                heap.append((-e.stat().st_size,
+                             (e.name, e.path, out_name, out_prefix + out_name)))
+    heapq.heapify(heap)
+    n_total = len(heap)
+    n_skip = n_found - n_total
     
-    elapsed_time = time.time() - start_time
+    def iter_work():
+        """Yield prebuilt tasks, largest pending file first."""
+        while heap:
+            yield heapq.heappop(heap)[1]
+    
+    print(f"Found {n_found} mzML files")
+    print(f"Skipping {n_skip} files (already done)")
+    print(f"Processing {n_total} files...")
+    
+    # Process in parallel
+    start_time = time.time()
     
-    # Print results
     print("\n" + "=" * 70)
     print("RESULTS")
     print("=" * 70)
     
-    for filename, success, message in results:
-        status = "✅" if success else "❌"
-        if message == "SKIP":
-            status = "⏭️ "
-        print(f"{status} {filename:<60} {message}")
+    # Long-lived workers import biosaur2 once and reuse it across files.
+    # ProcessPoolExecutor workers are not daemonic, so biosaur2 can still
+    # start its own -nprocs child processes. Workers are replaced every
+    # MAX_TASKS_PER_WORKER files so RSS cannot drift upwards on long runs.
+    # Only a small window of tasks is in flight; each completion pulls the
+    # next-largest file from the heap. Results stream back as they finish.
+    results = []
+    
+    # Explicit spawn context: shared objects handed to the workers must come
+    # from the same context as the pool (and max_tasks_per_child needs spawn)
+    mp_context = get_context("spawn")
+    
+    if Config.STAGE_DIR is not None:
+        Config.STAGE_DIR.mkdir(parents=True, exist_ok=True)
+    
+    # Keep biosaur2's OpenMP/MKL threads on the CPUs of their own block
+    os.environ.setdefault("OMP_PLACES", "cores")
+    os.environ.setdefault("OMP_PROC_BIND", "close")
+    os.environ.setdefault("MKL_NUM_THREADS", str(Config.CORES_PER_FILE))
+    
+    if args.xargs:
+        exec_xargs(list(iter_work()))
+    
+    # Files started so far, in shared memory: workers bump it and print a
+    # line when they pick up a file, so long runs are not silent until the
+    # first completion arrives
+    started = mp_context.Value(ctypes.c_uint64, 0)
+    
+    pool_kwargs = {"mp_context": mp_context}
+    if sys.version_info >= (3, 11):
+        pool_kwargs["max_tasks_per_child"] = Config.MAX_TASKS_PER_WORKER
+    
+    in_process = biosaur_in_process()
+    work = iter_work()
+    max_in_flight = 2 * Config.N_PARALLEL
+    
+    cpu_blocks = plan_cpu_blocks()
+    if cpu_blocks:
+        print(f"Pinning each file to {Config.CORES_PER_FILE} CPUs "
+              f"({len(cpu_blocks)} blocks)", flush=True)
+    
+    # A worker that dies (OOM kill, segfault in biosaur2's compiled code)
+    # breaks the whole pool. The file it was running still holds its shared
+    # slot and is reported as crashed; every other file lost with the pool
+    # is re-queued (first) on a fresh pool.
+    task_ids = itertools.count()
+    retry = []
+    strikes = {}  # crashes a file was caught in while the culprit was unknown
+    
+    def take(n: int) -> list:
+        tasks = retry[:n]
+        del retry[:n]
+        tasks.extend(itertools.islice(work, n - len(tasks)))
+        return tasks
+    
+    def record(result: tuple[str, bool, str]) -> None:
+        results.append(result)
+        checkpoint.record(result)
+        print_progress(len(results), n_total, result)
+    
+    while True:
+        slots = mp_context.Array("q", Config.N_PARALLEL)
+        tasks = {}   # task id -> task
+        lost = []    # task ids whose future died with the pool
+        worker_pids = set()
+        
+        with ProcessPoolExecutor(
+            max_workers=Config.N_PARALLEL,
+            initializer=_init_worker,
+            initargs=(started, n_total, slots, cpu_blocks, in_process),
+            **pool_kwargs
+        ) as pool:
+            pending = {}  # future -> task id
+            
+            def refill():
+                for task in take(max_in_flight - len(pending)):
+                    task_id = next(task_ids)
+                    tasks[task_id] = task
+                    pending[pool.submit(process_single_file, task, task_id)] = task_id
+                worker_pids.update(pool._processes or ())
+            
+            try:
+                refill()
+                while pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        task_id = pending.pop(fut)
+                        try:
+                            result = fut.result()
+                        except BrokenProcessPool:
+                            lost.append(task_id)
+                            continue
+                        del tasks[task_id]
+                        record(result)
+                    if lost:
+                        # Everything else in flight went down with the pool
+                        lost.extend(pending.values())
+                        pending.clear()
+                        break
+                    refill()
+            except BaseException:
+                # SIGTERM / Ctrl+C: checkpoint, drop queued files and stop the
+                # running ones instead of waiting for them
+                checkpoint.save()
+                _kill_workers(pool)  # before shutdown(), which forgets the workers
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            finally:
+                checkpoint.save()
+        
+        if not lost:
+            break
+        
+        # Orphaned biosaur2 children of the crashed worker
+        _kill_process_groups(worker_pids)
+        crashed = {v - 1 for v in slots if v}
+        for task_id in lost:
+            task = tasks[task_id]
+            if not crashed:
+                strikes[task[0]] = strikes.get(task[0], 0) + 1
+            if task_id in crashed or strikes.get(task[0], 0) >= 2:
+                record((task[0], False, "CRASHED (worker killed: out of memory?)"))
+            else:
+                retry.append(task)
+        # Nothing runs between pools: re-queued files are announced again
+        started.value = len(results)
+        print(f"⚠️  A worker died; restarting the pool "
+              f"({len(retry)} files re-queued)", flush=True)
+    
+    elapsed_time = time.time() - start_time
     
     # Summary
     n_ok = sum(1 for _, success, msg in results if success and msg == "OK")
-    n_skip = sum(1 for _, success, msg in results if msg == "SKIP")
     n_fail = sum(1 for _, success, _ in results if not success)
     
     print("\n" + "=" * 70)
@@ -198,19 +906,16 @@ def main():
     print(f"Skipped (already done): {n_skip}")
     print(f"Failed: {n_fail}")
     print(f"Total time: {elapsed_time/60:.1f} minutes")
-    print(f"Average per file: {elapsed_time/len(mzml_files):.1f} seconds")
+    print(f"Average per file: {elapsed_time/max(n_total, 1):.1f} seconds")
     print(f"Output directory: {Config.OUT_DIR}")
     print("=" * 70)
     
     # Count features
     try:
         feature_files = list(Config.OUT_DIR.glob("*.features.tsv"))
-        total_features = 0
-        for f in feature_files:
-            try:
-                total_features += sum(1 for _ in open(f)) - 1
-            except:
-                pass
+        # I/O bound (read() releases the GIL): overlap reads across files
+        with ThreadPoolExecutor(max_workers=16) as ex:
+            total_features = sum(ex.map(count_features, feature_files))
         print(f"\nTotal MS1 features extracted: {total_features:,}")
     except:
         pass
@@ -232,6 +937,9 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("\n\n⚠️  Interrupted by user (Ctrl+C)")
         sys.exit(130)
+    except Terminated:
+        print("\n\n⚠️  Terminated (SIGTERM); completed files are checkpointed")
+        sys.exit(143)
     except Exception as e:
         print(f"\n\n❌ FATAL ERROR: {e}")
         import traceback
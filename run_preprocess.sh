@@ -110,8 +110,8 @@ echo ""
 echo "Output files:"
 echo "  RAW files: $PROJECT_DIR/raw_data/raw/"
 echo "  mzML files: $PROJECT_DIR/raw_data/mzML_proper/"
-echo "  PSM clean: $PROJECT_DIR/processed_data/psm_clean.csv"
-echo "  PSM chimeric: $PROJECT_DIR/processed_data/psm_chimeric.csv"
+echo "  PSM clean: $PROJECT_DIR/processed_data/psm_clean.parquet"
+echo "  PSM chimeric: $PROJECT_DIR/processed_data/psm_chimeric.parquet"
 echo ""
 echo "Next step: Run 04_load_spectra.py to load mzML spectra"
 echo "============================================================"